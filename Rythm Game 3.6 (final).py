@@ -7,6 +7,12 @@ import warnings
 import numpy as np
 import os
 import math
+import threading
+import queue
+import sqlite3
+import platform
+import struct
+import gc
 from pygame import gfxdraw
 
 # Suppress librosa warnings
@@ -29,6 +35,37 @@ PARTICLE_COUNT = 100
 PROGRESS_BAR_WIDTH = 200
 PROGRESS_BAR_HEIGHT = 10
 PROGRESS_BAR_Y = 50
+SONG_END_EVENT = pygame.USEREVENT + 1   # Posted by the mixer when a track finishes
+RESULTS_DB = "results.db"
+RESULTS_SCHEMA_VERSION = 3                     # Bump with a step in ResultsStore._migrate
+PLAYER_NAME = os.environ.get("RHYTHM_PLAYER", "Player")
+ASSET_CACHE_DIR = ".asset_cache"               # Pre-scaled images, rebuilt when a source changes
+
+# Chart Analysis Constants
+DIFFICULTIES = ["easy", "normal", "hard"]
+ANALYSIS_N_FFT = 2048
+ANALYSIS_HOP = 512
+MIN_NOTE_GAP = 0.12                            # Seconds; closer notes are merged
+DENSITY_WINDOW = 2.0                           # Seconds of onsets averaged for note density
+HARD_MAX_DENSITY = 6                           # Onsets per second above which Hard sticks to beats
+LANE_BANDS = [                                 # Frequency band (Hz) that drives each lane
+    ("left", 0, 200),
+    ("down", 200, 800),
+    ("up", 800, 3000),
+    ("right", 3000, None)
+]
+
+# Timing Constants
+ARROW_TRAVEL_TIME = HIT_ZONE_Y / ARROW_SPEED   # Seconds from spawn until an arrow reaches the hit zone;
+                                               # arrows spawn this early so they arrive on their note
+HIT_WINDOW_MS = 50                             # Presses this close to a note count as hits
+HIT_WINDOW = HIT_WINDOW_MS / 1000
+TIMING_BUFFER_SIZE = 16384                     # Max hit offsets kept per run
+TIMING_HISTOGRAM_BINS = 15
+CALIBRATION_INTERVAL = 0.6                     # Seconds between metronome clicks or flashes
+CALIBRATION_FLASH = 0.1                        # Seconds each visual cue stays lit
+CALIBRATION_WARMUP = 4                         # Taps ignored while the player finds the beat
+CALIBRATION_TAPS = 16                          # Taps measured after the warmup
 
 # Character Display Constants
 IMAGE_X = SCREEN_WIDTH // 2 - 300      # X position (center of screen)
@@ -54,6 +91,13 @@ GRAY = (50, 50, 50)
 DARK_GRAY = (20, 20, 20)
 HIT_ZONE_BG = (100, 100, 100, 100)
 
+LANE_DIRECTIONS = {
+    pygame.K_LEFT: "left",
+    pygame.K_DOWN: "down",
+    pygame.K_UP: "up",
+    pygame.K_RIGHT: "right"
+}
+
 COLORS = {
     "left": NEON_YELLOW,
     "down": NEON_BLUE,
@@ -68,37 +112,196 @@ GLOW_COLORS = {
     "right": (*NEON_GREEN, GLOW_ALPHA)
 }
 
-def get_beat_times(filename):
+def assign_lanes(band_energy, frames):
+    """Pick each note's lane from its loudest band, stepping aside to avoid repeating a lane"""
+    ranked = np.argsort(-band_energy[:, frames], axis=0)
+    lanes = []
+    previous = None
+    for choices in ranked.T:
+        lane = choices[1] if choices[0] == previous else choices[0]
+        lanes.append(LANE_BANDS[lane][0])
+        previous = lane
+    return lanes
+
+def analyze_song(filename):
+    """Build every difficulty's chart from one decode and one STFT of a song.
+    
+    Returns (charts, song_length), where charts maps each name in DIFFICULTIES to
+    a list of (time, direction) notes and song_length is in seconds.
+    """
     try:
         y, sr = librosa.load(filename, sr=None)
-        tempo, beat_frames = librosa.beat.beat_track(y=y, sr=sr)
-        return librosa.frames_to_time(beat_frames, sr=sr).tolist()
+        spectrum = np.abs(librosa.stft(y, n_fft=ANALYSIS_N_FFT, hop_length=ANALYSIS_HOP))
+        
+        # Beats and onsets both come from the onset envelope of this one spectrogram
+        log_power = librosa.power_to_db(spectrum ** 2, ref=np.max)
+        onset_env = librosa.onset.onset_strength(S=log_power, sr=sr, hop_length=ANALYSIS_HOP)
+        tempo, beat_frames = librosa.beat.beat_track(onset_envelope=onset_env, sr=sr, hop_length=ANALYSIS_HOP)
+        onset_frames = librosa.onset.onset_detect(onset_envelope=onset_env, sr=sr, hop_length=ANALYSIS_HOP)
+        
+        # Energy per lane band, normalized so quieter bands still get their share of notes
+        freqs = librosa.fft_frequencies(sr=sr, n_fft=ANALYSIS_N_FFT)
+        band_energy = np.stack([
+            spectrum[(freqs >= low) & (freqs < (high or np.inf))].sum(axis=0)
+            for _, low, high in LANE_BANDS
+        ])
+        band_energy /= band_energy.mean(axis=1, keepdims=True) + 1e-9
+        
+        # Onsets per second around each frame
+        window = max(int(DENSITY_WINDOW * sr / ANALYSIS_HOP), 1)
+        onset_mask = np.zeros(len(onset_env))
+        onset_mask[onset_frames] = 1
+        density = np.convolve(onset_mask, np.ones(window), mode="same") / DENSITY_WINDOW
+        
+        hard_onsets = onset_frames[density[onset_frames] <= HARD_MAX_DENSITY]
+        note_frames = {
+            "easy": beat_frames[::2],
+            "normal": beat_frames,
+            "hard": np.union1d(beat_frames, hard_onsets)
+        }
+        
+        charts = {}
+        for difficulty, frames in note_frames.items():
+            times = librosa.frames_to_time(frames, sr=sr, hop_length=ANALYSIS_HOP)
+            keep = np.concatenate([[True], np.diff(times) >= MIN_NOTE_GAP]) if len(times) else []
+            frames, times = frames[keep], times[keep]
+            charts[difficulty] = list(zip(times.tolist(), assign_lanes(band_energy, frames)))
+        return charts, len(y) / sr
     except Exception as e:
         print(f"Error processing audio file: {e}")
-        return [i * 0.5 for i in range(30)]
+        directions = [lane for lane, _, _ in LANE_BANDS]
+        chart = [(i * 0.5, directions[i % len(directions)]) for i in range(30)]
+        return {difficulty: chart for difficulty in DIFFICULTIES}, 0
+
+def draw_rect(target, color, rect, width=0, border_radius=0):
+    """pygame.draw.rect that also accepts a DrawList"""
+    if isinstance(target, DrawList):
+        target.rect(color, rect, width, border_radius)
+    else:
+        pygame.draw.rect(target, color, rect, width, border_radius=border_radius)
+
+# Surfaces that never change, drawn once and reused every frame
+static_surface_cache = {}
+font_cache = {}
+
+def get_font(size):
+    """Return a cached Arial font; creating fonts is far too slow to do per frame"""
+    if size not in font_cache:
+        font_cache[size] = pygame.font.SysFont('Arial', size)
+    return font_cache[size]
 
 def draw_hit_zone(screen):
-    hit_zone_bg = pygame.Surface((SCREEN_WIDTH - 850, HIT_MARGIN * 2 + 20), pygame.SRCALPHA)
-    pygame.draw.rect(hit_zone_bg, HIT_ZONE_BG, (0, 0, hit_zone_bg.get_width(), hit_zone_bg.get_height()), 
-                    border_radius=10)
-    screen.blit(hit_zone_bg, (SCREEN_WIDTH - (SCREEN_WIDTH - 850) - 50, HIT_ZONE_Y - HIT_MARGIN - 10))
-    pygame.draw.rect(screen, WHITE, (SCREEN_WIDTH - (SCREEN_WIDTH - 850) - 50, int(HIT_ZONE_Y - HIT_MARGIN - 25),
+    if "hit_zone" not in static_surface_cache:
+        hit_zone_bg = pygame.Surface((SCREEN_WIDTH - 850, HIT_MARGIN * 2 + 20), pygame.SRCALPHA)
+        pygame.draw.rect(hit_zone_bg, HIT_ZONE_BG, (0, 0, hit_zone_bg.get_width(), hit_zone_bg.get_height()), 
+                        border_radius=10)
+        static_surface_cache["hit_zone"] = hit_zone_bg.convert_alpha()
+    screen.blit(static_surface_cache["hit_zone"], (SCREEN_WIDTH - (SCREEN_WIDTH - 850) - 50, HIT_ZONE_Y - HIT_MARGIN - 10))
+    draw_rect(screen, WHITE, (SCREEN_WIDTH - (SCREEN_WIDTH - 850) - 50, int(HIT_ZONE_Y - HIT_MARGIN - 25),
                         SCREEN_WIDTH - 850, 3), border_radius=1)
 
 def draw_frame(screen):
-    frame_color = (40, 40, 40, 200)
-    frame_surface = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SRCALPHA)
-    pygame.draw.rect(frame_surface, frame_color, (0, 0, SCREEN_WIDTH, MARGIN_SIZE))
-    bottom_frame_y = HIT_ZONE_Y + HIT_MARGIN + 75
-    pygame.draw.rect(frame_surface, frame_color, (0, bottom_frame_y, SCREEN_WIDTH, SCREEN_HEIGHT - bottom_frame_y))
-    pygame.draw.rect(frame_surface, frame_color, (0, 0, MARGIN_SIZE, SCREEN_HEIGHT))
-    pygame.draw.rect(frame_surface, frame_color, (SCREEN_WIDTH - MARGIN_SIZE, 0, MARGIN_SIZE, SCREEN_HEIGHT))
-    screen.blit(frame_surface, (0, 0))
+    if "frame" not in static_surface_cache:
+        frame_color = (40, 40, 40, 200)
+        frame_surface = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SRCALPHA)
+        pygame.draw.rect(frame_surface, frame_color, (0, 0, SCREEN_WIDTH, MARGIN_SIZE))
+        bottom_frame_y = HIT_ZONE_Y + HIT_MARGIN + 75
+        pygame.draw.rect(frame_surface, frame_color, (0, bottom_frame_y, SCREEN_WIDTH, SCREEN_HEIGHT - bottom_frame_y))
+        pygame.draw.rect(frame_surface, frame_color, (0, 0, MARGIN_SIZE, SCREEN_HEIGHT))
+        pygame.draw.rect(frame_surface, frame_color, (SCREEN_WIDTH - MARGIN_SIZE, 0, MARGIN_SIZE, SCREEN_HEIGHT))
+        static_surface_cache["frame"] = frame_surface.convert_alpha()
+    screen.blit(static_surface_cache["frame"], (0, 0))
+
+def draw_timing_histogram(screen, counts, mean, std, center_x, y):
+    """Draw hit offsets as a bar chart, early hits on the left and late hits on the right"""
+    width, height = 400, 100
+    left = center_x - width // 2
+    label = get_font(24).render(
+        f"TIMING: {mean:+.1f} ms  ±{std:.1f} ms", True, WHITE)
+    screen.blit(label, (center_x - label.get_width() // 2, y))
+    
+    top = y + 35
+    pygame.draw.rect(screen, GRAY, (left, top, width, height), 1)
+    pygame.draw.line(screen, WHITE, (center_x, top), (center_x, top + height))
+    peak = max(int(counts.max()), 1) if len(counts) else 1
+    bar_width = width / max(len(counts), 1)
+    for i, count in enumerate(counts):
+        bar_height = int(height * count / peak)
+        pygame.draw.rect(screen, NEON_BLUE, (int(left + i * bar_width) + 1, top + height - bar_height,
+                                             max(int(bar_width) - 2, 1), bar_height))
+
+def make_click_sound():
+    """Build a short metronome click matching the mixer's format"""
+    freq, size, channels = pygame.mixer.get_init()
+    t = np.arange(int(freq * 0.03)) / freq
+    wave = (np.sin(2 * np.pi * 1000 * t) * np.exp(-t * 150) * 32767 * 0.8).astype(np.int16)
+    if channels > 1:
+        wave = np.repeat(wave[:, None], channels, axis=1)
+    return pygame.sndarray.make_sound(np.ascontiguousarray(wave))
+
+def bake_image(filename, size=None, scale=None):
+    """Return a pre-scaled copy of an image, read from the asset cache or baked into it now.
+    
+    The cache key includes the source's file name, mtime and target size/scale,
+    so editing an image or changing a scale constant rebakes it automatically.
+    """
+    name = os.path.basename(filename)
+    mtime = os.stat(filename).st_mtime_ns
+    tag = f"{size[0]}x{size[1]}" if size else f"x{scale}"
+    cache_path = os.path.join(ASSET_CACHE_DIR, f"{name}-{mtime}-{tag}.rgba")
+    try:
+        with open(cache_path, "rb") as f:
+            data = f.read()
+        width, height = struct.unpack("<II", data[:8])
+        return pygame.image.fromstring(data[8:], (width, height), "RGBA")
+    except (OSError, struct.error, ValueError):
+        pass  # Not baked yet, or the bake is unreadable
+    
+    img = pygame.image.load(filename)
+    if size is None:
+        size = (int(img.get_width() * scale), int(img.get_height() * scale))
+    img = pygame.transform.scale(img, size)
+    
+    try:
+        os.makedirs(ASSET_CACHE_DIR, exist_ok=True)
+        # Drop bakes of older versions of this image at this size, leaving other sizes alone
+        prefix, suffix = f"{name}-", f"-{tag}.rgba"
+        for old_file in os.listdir(ASSET_CACHE_DIR):
+            if old_file.startswith(prefix) and old_file.endswith(suffix):
+                old_mtime = old_file[len(prefix):-len(suffix)]
+                if old_mtime.isdigit() and int(old_mtime) < mtime:
+                    os.remove(os.path.join(ASSET_CACHE_DIR, old_file))
+        temp_path = cache_path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(struct.pack("<II", *img.get_size()))
+            f.write(pygame.image.tostring(img, "RGBA"))
+        os.replace(temp_path, cache_path)
+    except OSError as e:
+        # A read-only install still runs, it just scales the source on every launch
+        print(f"Error writing asset cache: {e}")
+    return img
+
+def load_baked_image(filename, size=None, scale=None, alpha=True):
+    """Load a pre-scaled image, converted to the display's pixel format"""
+    img = bake_image(filename, size, scale)
+    return img.convert_alpha() if alpha else img.convert()
+
+def bake_assets():
+    """Bake every image the game loads so the first launch doesn't have to"""
+    assets = [(f"{direction}.png", (ARROW_SIZE, ARROW_SIZE), None) for direction in COLORS]
+    assets += [(f"miku_{direction}.png", None, IMAGE_SCALE) for direction in COLORS]
+    assets += [("teto1.png", None, TETO_SCALE), ("teto2.png", None, TETO_SCALE)]
+    assets.append(("background.png", (SCREEN_WIDTH - 2*MARGIN_SIZE, SCREEN_HEIGHT - 2*MARGIN_SIZE), None))
+    for filename, size, scale in assets:
+        try:
+            bake_image(filename, size, scale)
+            print(f"Baked {filename}")
+        except FileNotFoundError:
+            print(f"Skipping missing image: {filename}")
 
 def load_arrow_image(direction):
     try:
-        img = pygame.image.load(f"{direction}.png").convert_alpha()
-        return pygame.transform.scale(img, (ARROW_SIZE, ARROW_SIZE))
+        return load_baked_image(f"{direction}.png", size=(ARROW_SIZE, ARROW_SIZE))
     except:
         surf = pygame.Surface((ARROW_SIZE, ARROW_SIZE), pygame.SRCALPHA)
         color = COLORS[direction]
@@ -111,35 +314,65 @@ def load_arrow_image(direction):
         elif direction == "down":
             points = [(0, 0), (ARROW_SIZE//2, ARROW_SIZE), (ARROW_SIZE, 0)]
         pygame.draw.polygon(surf, color, points)
-        return surf
+        return surf.convert_alpha()
+
+arrow_image_cache = {}
+
+def get_arrow_images():
+    """Load the four outlined arrow images once and share them between all arrows"""
+    if not arrow_image_cache:
+        for direction in COLORS:
+            arrow_img = load_arrow_image(direction)
+            outlined = pygame.Surface((ARROW_SIZE + 6, ARROW_SIZE + 6), pygame.SRCALPHA)
+            for point in pygame.mask.from_surface(arrow_img).outline():
+                for dx, dy in [(-1,-1), (-1,0), (-1,1), (0,-1), (0,1), (1,-1), (1,0), (1,1)]:
+                    x, y = point[0] + 3 + dx, point[1] + 3 + dy
+                    if 0 <= x < ARROW_SIZE + 6 and 0 <= y < ARROW_SIZE + 6:
+                        outlined.set_at((x, y), WHITE)
+            outlined.blit(arrow_img, (3, 3))
+            arrow_image_cache[direction] = outlined.convert_alpha()
+    return arrow_image_cache
+
+arrow_pool = []
+effect_pool = []
+effect_surface_pool = []   # Hit effect surfaces the render thread has finished with
+
+def build_arrows(chart, result):
+    """Build a chart's arrows, reusing arrows pooled from earlier songs"""
+    arrows = []
+    for t, direction in chart:
+        if arrow_pool:
+            arrow = arrow_pool.pop()
+            arrow.reset(direction, t - ARROW_TRAVEL_TIME)
+        else:
+            arrow = Arrow(direction, t - ARROW_TRAVEL_TIME)
+        arrow.result = result
+        arrows.append(arrow)
+    return arrows
+
+def spawn_hit_effect(hit_effects, text, color, x, y, timer, size):
+    effect = effect_pool.pop() if effect_pool else HitEffect()
+    effect.reset(text, color, x, y, timer, size)
+    hit_effects.append(effect)
+
+def begin_low_alloc_play():
+    """Collect once, then keep the cyclic GC out of the way until the song ends"""
+    gc.collect()
+    gc.freeze()
+    gc.disable()
+
+def end_low_alloc_play():
+    gc.unfreeze()
+    gc.enable()
 
 def load_miku_images():
     """Load and scale Miku images for direction display"""
     try:
-        miku_up = pygame.image.load("miku_up.png")
-        miku_left = pygame.image.load("miku_left.png")
-        miku_right = pygame.image.load("miku_right.png")
-        miku_down = pygame.image.load("miku_down.png")
-        
-        # Scale images according to the constant
-        miku_up = pygame.transform.scale(miku_up, 
-            (int(miku_up.get_width() * IMAGE_SCALE), 
-             int(miku_up.get_height() * IMAGE_SCALE)))
-        miku_left = pygame.transform.scale(miku_left, 
-            (int(miku_left.get_width() * IMAGE_SCALE), 
-             int(miku_left.get_height() * IMAGE_SCALE)))
-        miku_right = pygame.transform.scale(miku_right, 
-            (int(miku_right.get_width() * IMAGE_SCALE), 
-             int(miku_right.get_height() * IMAGE_SCALE)))
-        miku_down = pygame.transform.scale(miku_down, 
-            (int(miku_down.get_width() * IMAGE_SCALE), 
-             int(miku_down.get_height() * IMAGE_SCALE)))
-        
         return {
-            "up": miku_up,
-            "left": miku_left,
-            "right": miku_right,
-            "down": miku_down
+            "up": load_baked_image("miku_up.png", scale=IMAGE_SCALE),
+            "left": load_baked_image("miku_left.png", scale=IMAGE_SCALE),
+            "right": load_baked_image("miku_right.png", scale=IMAGE_SCALE),
+            "down": load_baked_image("miku_down.png", scale=IMAGE_SCALE)
         }
     except FileNotFoundError as e:
         print(f"Error loading Miku image files: {e}")
@@ -148,17 +381,8 @@ def load_miku_images():
 def load_teto_images():
     """Load and scale Teto images"""
     try:
-        teto1 = pygame.image.load("teto1.png").convert_alpha()
-        teto2 = pygame.image.load("teto2.png").convert_alpha()
-        
-        # Scale images
-        teto1 = pygame.transform.scale(teto1, 
-            (int(teto1.get_width() * TETO_SCALE), 
-             int(teto1.get_height() * TETO_SCALE)))
-        teto2 = pygame.transform.scale(teto2, 
-            (int(teto2.get_width() * TETO_SCALE), 
-             int(teto2.get_height() * TETO_SCALE)))
-        
+        teto1 = load_baked_image("teto1.png", scale=TETO_SCALE)
+        teto2 = load_baked_image("teto2.png", scale=TETO_SCALE)
         return teto1, teto2
     except FileNotFoundError as e:
         print(f"Error loading Teto image files: {e}")
@@ -167,25 +391,31 @@ def load_teto_images():
         pygame.draw.circle(teto1, (255, 100, 100), (50, 50), 50)
         teto2 = pygame.Surface((100, 100), pygame.SRCALPHA)
         pygame.draw.rect(teto2, (100, 100, 255), (25, 25, 50, 50))
-        return teto1, teto2
+        return teto1.convert_alpha(), teto2.convert_alpha()
+
+ARROW_X = {"left": SCREEN_WIDTH - 450, "down": SCREEN_WIDTH - 350, "up": SCREEN_WIDTH - 250, "right": SCREEN_WIDTH - 150}
 
 class Arrow:
+    __slots__ = ("direction", "spawn_time", "x", "y", "hit", "glow", "bounce_time",
+                 "original_y", "shake_offset", "arrow_images", "result")
+    
     def __init__(self, direction, spawn_time):
+        self.shake_offset = [0, 0]
+        self.arrow_images = get_arrow_images()
+        self.reset(direction, spawn_time)
+    
+    def reset(self, direction, spawn_time):
+        """Prepare a new or pooled arrow for a note"""
         self.direction = direction
         self.spawn_time = float(spawn_time)
-        self.x = {"left": SCREEN_WIDTH - 450, "down": SCREEN_WIDTH - 350, "up": SCREEN_WIDTH - 250, "right": SCREEN_WIDTH - 150}[direction]
+        self.x = ARROW_X[direction]
         self.y = -ARROW_SIZE
         self.hit = False
         self.glow = True
         self.bounce_time = 0
         self.original_y = HIT_ZONE_Y
-        self.shake_offset = [0, 0]
-        self.arrow_images = {
-            "left": load_arrow_image("left"),
-            "down": load_arrow_image("down"),
-            "up": load_arrow_image("up"),
-            "right": load_arrow_image("right")
-        }
+        self.shake_offset[0] = 0
+        self.shake_offset[1] = 0
 
     def update(self, elapsed_time, combo):
         if not self.hit:
@@ -198,9 +428,11 @@ class Arrow:
             self.y = self.original_y - bounce_height
         
         if combo > 50 and not self.hit:
-            self.shake_offset = [random.randint(-5, 5), random.randint(-5, 5)]
+            self.shake_offset[0] = random.randint(-5, 5)
+            self.shake_offset[1] = random.randint(-5, 5)
         else:
-            self.shake_offset = [0, 0]
+            self.shake_offset[0] = 0
+            self.shake_offset[1] = 0
 
     def draw(self, screen):
         if self.hit and self.bounce_time <= 0:
@@ -208,19 +440,249 @@ class Arrow:
             
         draw_x = self.x + self.shake_offset[0]
         draw_y = self.y + self.shake_offset[1]
-        arrow_img = self.arrow_images[self.direction]
+        # The cached image includes the 3px outline around the arrow
+        screen.blit(self.arrow_images[self.direction], (draw_x - 3, draw_y - 3))
+
+class HitEffect:
+    """Floating judgment text; pooled so hits don't allocate during play"""
+    __slots__ = ("text", "color", "x", "y", "timer", "size", "rendered_size", "surface")
+    
+    def __init__(self):
+        self.surface = None
+    
+    def reset(self, text, color, x, y, timer, size):
+        self.text = text
+        self.color = color
+        self.x = x
+        self.y = y
+        self.timer = timer
+        self.size = size
+        self.rendered_size = None
+    
+    def update_and_draw(self, screen):
+        self.size = min(self.size + 0.05, 1.2)
+        size = int(24 * self.size)
         
-        outline_surface = pygame.Surface((ARROW_SIZE + 6, ARROW_SIZE + 6), pygame.SRCALPHA)
-        mask = pygame.mask.from_surface(arrow_img)
-        outline = mask.outline()
-        for point in outline:
-            for dx, dy in [(-1,-1), (-1,0), (-1,1), (0,-1), (0,1), (1,-1), (1,0), (1,1)]:
-                x, y = point[0] + 3 + dx, point[1] + 3 + dy
-                if 0 <= x < ARROW_SIZE + 6 and 0 <= y < ARROW_SIZE + 6:
-                    outline_surface.set_at((x, y), WHITE)
+        # Only re-render while the text is still growing
+        if size != self.rendered_size:
+            if isinstance(screen, DrawList):
+                # Frames published to the render thread may still show the old surface,
+                # so switch to another and let the thread hand the old one back when done
+                if self.surface is not None:
+                    screen.retire(self.surface)
+                self.surface = (effect_surface_pool.pop() if effect_surface_pool
+                                else pygame.Surface((200, 50), pygame.SRCALPHA))
+            elif self.surface is None:
+                self.surface = pygame.Surface((200, 50), pygame.SRCALPHA)
+            self.surface.fill((0, 0, 0, 0))
+            font = get_font(size)
+            for dx, dy in [(-1,-1), (-1,1), (1,-1), (1,1)]:
+                outline = font.render(self.text, True, BLACK)
+                self.surface.blit(outline, (25 + dx, 10 + dy))
+            main_text = font.render(self.text, True, self.color)
+            self.surface.blit(main_text, (25, 10))
+            self.rendered_size = size
         
-        screen.blit(outline_surface, (draw_x - 3, draw_y - 3))
-        screen.blit(arrow_img, (draw_x, draw_y))
+        screen.blit(self.surface, (self.x, self.y))
+        self.timer -= 1
+        self.y -= 1
+
+class DrawList:
+    """Draw commands for one frame, recorded on the main thread and replayed by RenderThread.
+    
+    Only blit, fill and rect are supported, which is all the play screen uses.
+    Once published the commands are frozen into a tuple and never touched again.
+    Surfaces retired while recording go back to effect_surface_pool after the
+    frame is shown, when no earlier frame can still be drawing them.
+    """
+    __slots__ = ("commands", "retired")
+    
+    def __init__(self):
+        self.commands = []
+        self.retired = []
+    
+    def blit(self, surface, pos):
+        self.commands.append(("blit", surface, pos))
+    
+    def fill(self, color):
+        self.commands.append(("fill", color))
+    
+    def rect(self, color, rect, width=0, border_radius=0):
+        self.commands.append(("rect", color, rect, width, border_radius))
+    
+    def retire(self, surface):
+        self.retired.append(surface)
+    
+    def freeze(self):
+        self.commands = tuple(self.commands)
+    
+    def render(self, screen):
+        for command in self.commands:
+            if command[0] == "blit":
+                screen.blit(command[1], command[2])
+            elif command[0] == "fill":
+                screen.fill(command[1])
+            else:
+                pygame.draw.rect(screen, command[1], command[2], command[3], border_radius=command[4])
+
+class RenderThread:
+    """Replays published DrawLists and flips the display on a separate thread.
+    
+    SDL releases the GIL while blitting and presenting, so a slow frame no
+    longer holds up event handling and judgment on the main thread. If the
+    renderer falls behind, an unrendered frame is replaced by the newer one.
+    """
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.pending = None
+        self.busy = False
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+    
+    def publish(self, draw_list):
+        draw_list.freeze()
+        with self.condition:
+            if self.pending is not None:
+                # The skipped frame's retired surfaces are only free once this one is shown
+                draw_list.retired.extend(self.pending.retired)
+            self.pending = draw_list
+            self.condition.notify_all()
+    
+    def wait_idle(self):
+        """Block until every published frame is on screen, before drawing from the main thread"""
+        with self.condition:
+            while self.pending is not None or self.busy:
+                self.condition.wait()
+    
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.pending is None and self.running:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                draw_list = self.pending
+                self.pending = None
+                self.busy = True
+            try:
+                draw_list.render(pygame.display.get_surface())
+                pygame.display.flip()
+            except Exception as e:
+                print(f"Error rendering frame: {e}")
+            finally:
+                effect_surface_pool.extend(draw_list.retired)
+                with self.condition:
+                    self.busy = False
+                    self.condition.notify_all()
+    
+    def stop(self):
+        self.wait_idle()
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.thread.join()
+
+class CachedText:
+    """Text surface that is only re-rendered when its text changes"""
+    __slots__ = ("font", "color", "text", "surface")
+    
+    def __init__(self, font, color):
+        self.font = font
+        self.color = color
+        self.text = None
+        self.surface = None
+    
+    def render(self, text):
+        if text != self.text:
+            self.text = text
+            self.surface = self.font.render(text, True, self.color)
+        return self.surface
+
+class InputClock:
+    """Paces the main loop like pygame.time.Clock, timestamping events as they arrive.
+    
+    Rather than sleeping out the rest of each frame, it waits on the event queue
+    and notes when every event was taken off it, so a key press is timed to
+    about a millisecond instead of to whenever the next frame handles it.
+    Events that arrive while a frame is being simulated or drawn are stamped
+    when the wait begins.
+    """
+    def __init__(self, fps):
+        self.frame_time = 1 / fps
+        self.last_tick = time.time()
+    
+    def tick(self):
+        """Wait for the next frame; returns (dt, [(arrival time, event), ...])"""
+        now = time.time()
+        events = [(now, event) for event in pygame.event.get()]
+        deadline = self.last_tick + self.frame_time
+        while now < deadline:
+            event = pygame.event.wait(max(1, int((deadline - now) * 1000)))
+            now = time.time()
+            if event.type != pygame.NOEVENT:
+                events.append((now, event))
+        dt = now - self.last_tick
+        self.last_tick = now
+        return dt, events
+
+class GCMonitor:
+    """Tracks the net change in GC-tracked objects and collector pauses between samples"""
+    def __init__(self):
+        self.collections = 0
+        self.pause_time = 0.0
+        self.collect_start = 0.0
+        self.last_count = gc.get_count()[0]
+        gc.callbacks.append(self._on_collect)
+    
+    def _on_collect(self, phase, info):
+        if phase == "start":
+            self.collect_start = time.perf_counter()
+        else:
+            self.collections += 1
+            self.pause_time += time.perf_counter() - self.collect_start
+    
+    def sample(self):
+        """Return (net tracked objects, collections, pause ms) since the previous sample"""
+        # The generation 0 count rises when a tracked object is created and falls when
+        # one is freed, so short-lived temporaries cancel out. Any collection resets it.
+        count = gc.get_count()[0]
+        net_objects = count if self.collections else count - self.last_count
+        self.last_count = count
+        result = (net_objects, self.collections, self.pause_time * 1000)
+        self.collections = 0
+        self.pause_time = 0.0
+        return result
+
+class TimingTelemetry:
+    """Signed timing offsets in milliseconds, kept in a preallocated NumPy buffer"""
+    def __init__(self, capacity):
+        self.buffer = np.zeros(capacity, dtype=np.float32)
+        self.count = 0
+    
+    def reset(self):
+        self.count = 0
+    
+    def record(self, offset_ms):
+        # Once the buffer is full, further samples are dropped rather than reallocating
+        if self.count < len(self.buffer):
+            self.buffer[self.count] = offset_ms
+            self.count += 1
+    
+    def samples(self):
+        return self.buffer[:self.count]
+    
+    def stats(self):
+        """Return (mean, stddev) of the recorded offsets"""
+        if self.count == 0:
+            return 0.0, 0.0
+        samples = self.samples()
+        return float(samples.mean()), float(samples.std())
+    
+    def histogram(self, bins, limit):
+        """Count offsets in evenly sized bins between -limit and +limit ms"""
+        counts, _ = np.histogram(self.samples(), bins=bins, range=(-limit, limit))
+        return counts
 
 class Particle:
     def __init__(self, x, y):
@@ -260,10 +722,8 @@ class TetoAnimation:
         self.bounce_height = math.sin(pygame.time.get_ticks() * BOUNCE_SPEED) * MAX_BOUNCE
         
         # Calculate position relative to Miku
-        self.pos = [
-            miku_pos[0] + TETO_OFFSET_X,
-            miku_pos[1] + TETO_OFFSET_Y + self.bounce_height
-        ]
+        self.pos[0] = miku_pos[0] + TETO_OFFSET_X
+        self.pos[1] = miku_pos[1] + TETO_OFFSET_Y + self.bounce_height
     
     def draw(self, screen):
         """Draw the current Teto image"""
@@ -296,6 +756,10 @@ class SongSelector:
         self.scroll_bar_pos = 0
         self.scroll_bar_dragging = False
         self.scroll_area_height = SCREEN_HEIGHT - 250  # Height available for songs display
+        self.playlist_mode = False
+        self.playlist_rect = pygame.Rect(SCREEN_WIDTH - 300, SCREEN_HEIGHT - 100, 250, 50)
+        self.difficulty = "normal"
+        self.difficulty_rect = pygame.Rect(SCREEN_WIDTH - 600, SCREEN_HEIGHT - 100, 270, 50)
         
     def draw(self, screen):
         screen.fill(DARK_GRAY)
@@ -348,8 +812,24 @@ class SongSelector:
         back_text = self.font.render("Back", True, NEON_BLUE)
         screen.blit(back_text, (back_rect.centerx - back_text.get_width()//2, 
                                back_rect.centery - back_text.get_height()//2))
+        
+        playlist_color = NEON_GREEN if self.playlist_mode else WHITE
+        pygame.draw.rect(screen, playlist_color, self.playlist_rect, 2)
+        playlist_text = self.font.render(f"Playlist: {'ON' if self.playlist_mode else 'OFF'}", True, playlist_color)
+        screen.blit(playlist_text, (self.playlist_rect.centerx - playlist_text.get_width()//2, 
+                                   self.playlist_rect.centery - playlist_text.get_height()//2))
+        
+        pygame.draw.rect(screen, NEON_YELLOW, self.difficulty_rect, 2)
+        difficulty_text = self.font.render(f"Level: {self.difficulty.upper()}", True, NEON_YELLOW)
+        screen.blit(difficulty_text, (self.difficulty_rect.centerx - difficulty_text.get_width()//2, 
+                                     self.difficulty_rect.centery - difficulty_text.get_height()//2))
         return back_rect
     
+    def build_playlist(self):
+        """Return the selected song followed by every song after it in the list"""
+        start = self.songs.index(self.selected_song)
+        return [os.path.join(self.soundtrack_folder, song) for song in self.songs[start:]]
+    
     def handle_event(self, event):
         if self.empty_folder:
             return None
@@ -397,6 +877,13 @@ class SongSelector:
             back_rect = pygame.Rect(50, SCREEN_HEIGHT - 100, 200, 50)
             if back_rect.collidepoint(mouse_pos):
                 return "back"
+            
+            if self.playlist_rect.collidepoint(mouse_pos):
+                self.playlist_mode = not self.playlist_mode
+            
+            if self.difficulty_rect.collidepoint(mouse_pos):
+                next_index = (DIFFICULTIES.index(self.difficulty) + 1) % len(DIFFICULTIES)
+                self.difficulty = DIFFICULTIES[next_index]
         
         elif event.type == pygame.MOUSEBUTTONUP:
             self.scroll_bar_dragging = False
@@ -409,11 +896,260 @@ class SongSelector:
         
         return None
 
+class PlaylistPrefetcher:
+    """Analyze the next playlist song on a background thread"""
+    def __init__(self):
+        self.chart_cache = {}
+        self.lock = threading.Lock()
+        self.song = None
+        self.ready = False
+        self.charts = {}
+        self.song_length = 0
+    
+    def start(self, song):
+        """Begin preparing a song, dropping whatever was prepared before"""
+        with self.lock:
+            self.song = song
+            self.ready = False
+        threading.Thread(target=self._prepare, args=(song,), daemon=True).start()
+    
+    def reset(self):
+        with self.lock:
+            self.song = None
+            self.ready = False
+    
+    def _prepare(self, song):
+        if song not in self.chart_cache:
+            self.chart_cache[song] = analyze_song(song)
+        charts, song_length = self.chart_cache[song]
+        
+        with self.lock:
+            # A newer request (or a reset) replaced this one while we were working
+            if self.song != song:
+                return
+            self.charts = charts
+            self.song_length = song_length
+            self.ready = True
+
+class SongResult:
+    """Score and note judgments for one song of a run.
+    
+    Arrows point back at the result of the song they came from, so notes that
+    are still falling when a playlist moves on are credited to the right song.
+    """
+    def __init__(self, song, difficulty, notes):
+        self.song = song
+        self.difficulty = difficulty
+        self.notes = notes
+        self.score = 0
+        self.hits = 0
+        self.total = 0
+        self.max_combo = 0
+        self.judgments = []
+        self.time_shift = 0.0   # Seconds between this song's clock and the one its arrows now run on
+
+class ResultsStore:
+    """SQLite store of finished plays and their per-note judgments.
+    
+    Plays are queued by the game loop and written in batches by a background
+    thread, so saving never holds up a frame.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.pending = queue.Queue()
+        self.conn = None
+        try:
+            self.conn = self._connect()
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS plays (
+                    id INTEGER PRIMARY KEY,
+                    player TEXT NOT NULL,
+                    song TEXT NOT NULL,
+                    difficulty TEXT NOT NULL,
+                    played_at REAL NOT NULL,
+                    score INTEGER NOT NULL,
+                    accuracy REAL NOT NULL,
+                    hit_arrows INTEGER NOT NULL,
+                    total_arrows INTEGER NOT NULL,
+                    max_combo INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS judgments (
+                    play_id INTEGER NOT NULL REFERENCES plays(id),
+                    note_index INTEGER NOT NULL,
+                    spawn_time REAL NOT NULL,
+                    direction TEXT NOT NULL,
+                    judgment TEXT NOT NULL,
+                    offset_ms REAL,
+                    PRIMARY KEY (play_id, note_index)
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS calibration (
+                    device TEXT PRIMARY KEY,
+                    offset_ms REAL NOT NULL,
+                    calibrated_at REAL NOT NULL,
+                    visual_offset_ms REAL NOT NULL DEFAULT 0
+                );
+            """)
+            self._migrate()
+            self.conn.executescript("""
+                CREATE INDEX IF NOT EXISTS plays_song_score ON plays (song, difficulty, score DESC);
+                CREATE INDEX IF NOT EXISTS plays_player_time ON plays (player, played_at DESC);
+                CREATE INDEX IF NOT EXISTS plays_player_song_score ON plays (player, song, difficulty, score DESC);
+            """)
+        except sqlite3.Error as e:
+            print(f"Error opening results database: {e}")
+            self.conn = None
+            return
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+    
+    def _connect(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+    
+    def _migrate(self):
+        """Bring a database written by an older build up to RESULTS_SCHEMA_VERSION"""
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= RESULTS_SCHEMA_VERSION:
+            return
+        with self.conn:
+            if version < 1:
+                # Early builds didn't record hit offsets
+                columns = {row[1] for row in self.conn.execute("PRAGMA table_info(judgments)")}
+                if "offset_ms" not in columns:
+                    self.conn.execute("ALTER TABLE judgments ADD COLUMN offset_ms REAL")
+            if version < 2:
+                columns = {row[1] for row in self.conn.execute("PRAGMA table_info(plays)")}
+                if "difficulty" not in columns:
+                    # Plays from before difficulties existed used the Normal chart
+                    self.conn.execute(
+                        "ALTER TABLE plays ADD COLUMN difficulty TEXT NOT NULL DEFAULT 'normal'")
+                # The leaderboard indexes now lead with difficulty, so rebuild them
+                self.conn.execute("DROP INDEX IF EXISTS plays_song_score")
+                self.conn.execute("DROP INDEX IF EXISTS plays_player_song_score")
+            if version < 3:
+                # Calibration used to measure audio latency only, which offset_ms keeps holding
+                columns = {row[1] for row in self.conn.execute("PRAGMA table_info(calibration)")}
+                if "visual_offset_ms" not in columns:
+                    self.conn.execute(
+                        "ALTER TABLE calibration ADD COLUMN visual_offset_ms REAL NOT NULL DEFAULT 0")
+            self.conn.execute(f"PRAGMA user_version = {RESULTS_SCHEMA_VERSION}")
+    
+    def record_play(self, player, song, difficulty, score, hit_arrows, total_arrows, max_combo, judgments):
+        """Queue a finished play; judgments is a list of (spawn_time, direction, judgment, offset_ms)"""
+        if self.conn is None:
+            return
+        accuracy = (hit_arrows / total_arrows) * 100 if total_arrows > 0 else 0
+        self.pending.put((player, song, difficulty, time.time(), score, accuracy,
+                          hit_arrows, total_arrows, max_combo, list(judgments)))
+    
+    def _write_loop(self):
+        conn = self._connect()
+        running = True
+        while running:
+            # Block for one play, then take everything else that is waiting
+            batch = [self.pending.get()]
+            while not self.pending.empty():
+                batch.append(self.pending.get_nowait())
+            if None in batch:
+                running = False
+                batch = [play for play in batch if play is not None]
+            try:
+                with conn:
+                    for *summary, judgments in batch:
+                        cursor = conn.execute(
+                            "INSERT INTO plays (player, song, difficulty, played_at, score, accuracy, "
+                            "hit_arrows, total_arrows, max_combo) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            summary)
+                        conn.executemany(
+                            "INSERT INTO judgments VALUES (?, ?, ?, ?, ?, ?)",
+                            [(cursor.lastrowid, i, *judgment) for i, judgment in enumerate(judgments)])
+            except sqlite3.Error as e:
+                print(f"Error saving results: {e}")
+        conn.close()
+    
+    def top_scores(self, song, difficulty, limit=100):
+        """Return (player, score, accuracy, played_at) rows for a song's leaderboard"""
+        if self.conn is None:
+            return []
+        try:
+            return self.conn.execute(
+                "SELECT player, score, accuracy, played_at FROM plays "
+                "WHERE song = ? AND difficulty = ? ORDER BY score DESC LIMIT ?",
+                (song, difficulty, limit)).fetchall()
+        except sqlite3.Error as e:
+            print(f"Error reading leaderboard: {e}")
+            return []
+    
+    def personal_best(self, player, song, difficulty):
+        """Return a player's best score on a song, or None if they never finished it"""
+        if self.conn is None:
+            return None
+        try:
+            row = self.conn.execute(
+                "SELECT score FROM plays WHERE player = ? AND song = ? AND difficulty = ? "
+                "ORDER BY score DESC LIMIT 1", (player, song, difficulty)).fetchone()
+        except sqlite3.Error as e:
+            print(f"Error reading personal best: {e}")
+            return None
+        return row[0] if row else None
+    
+    def player_history(self, player, limit=20):
+        """Return a player's most recent (song, difficulty, score, accuracy, played_at) rows"""
+        if self.conn is None:
+            return []
+        try:
+            return self.conn.execute(
+                "SELECT song, difficulty, score, accuracy, played_at FROM plays "
+                "WHERE player = ? ORDER BY played_at DESC LIMIT ?", (player, limit)).fetchall()
+        except sqlite3.Error as e:
+            print(f"Error reading play history: {e}")
+            return []
+    
+    def load_calibration(self, device):
+        """Return a device's stored (audio, visual) latency in ms, or None if it was never calibrated"""
+        if self.conn is None:
+            return None
+        try:
+            return self.conn.execute(
+                "SELECT offset_ms, visual_offset_ms FROM calibration WHERE device = ?",
+                (device,)).fetchone()
+        except sqlite3.Error as e:
+            print(f"Error loading calibration: {e}")
+            return None
+    
+    def save_calibration(self, device, audio_offset_ms, visual_offset_ms):
+        if self.conn is None:
+            return
+        try:
+            with self.conn:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO calibration (device, offset_ms, visual_offset_ms, calibrated_at) "
+                    "VALUES (?, ?, ?, ?)", (device, audio_offset_ms, visual_offset_ms, time.time()))
+        except sqlite3.Error as e:
+            print(f"Error saving calibration: {e}")
+    
+    def close(self):
+        """Flush any queued plays and close the database"""
+        if self.conn is None:
+            return
+        self.pending.put(None)
+        self.writer.join()
+        self.conn.close()
+
 # Initialize pygame
 pygame.init()
+if "--bake-assets" in sys.argv:
+    bake_assets()
+    pygame.quit()
+    sys.exit()
 screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
 pygame.display.set_caption("Anime Rhythm")
-clock = pygame.time.Clock()
+# Optional: blit and flip the play screen on a separate render thread
+renderer = RenderThread() if "--pipelined" in sys.argv else None
+input_clock = InputClock(FPS)
+pygame.mixer.music.set_endevent(SONG_END_EVENT)
 
 # Load Miku images
 miku_images = load_miku_images()
@@ -423,17 +1159,16 @@ current_miku_image = miku_images["up"] if miku_images else None
 teto_animation = TetoAnimation()
 
 try:
-    background = pygame.image.load("background.png").convert()
-    background = pygame.transform.scale(background, (SCREEN_WIDTH - 2*MARGIN_SIZE, SCREEN_HEIGHT - 2*MARGIN_SIZE))
+    background = load_baked_image("background.png", size=(SCREEN_WIDTH - 2*MARGIN_SIZE, SCREEN_HEIGHT - 2*MARGIN_SIZE), alpha=False)
 except:
     try:
-        background = pygame.image.load("background.jpg").convert()
-        background = pygame.transform.scale(background, (SCREEN_WIDTH - 2*MARGIN_SIZE, SCREEN_HEIGHT - 2*MARGIN_SIZE))
+        background = load_baked_image("background.jpg", size=(SCREEN_WIDTH - 2*MARGIN_SIZE, SCREEN_HEIGHT - 2*MARGIN_SIZE), alpha=False)
     except:
         background = pygame.Surface((SCREEN_WIDTH - 2*MARGIN_SIZE, SCREEN_HEIGHT - 2*MARGIN_SIZE))
         for y in range(background.get_height()):
             darkness = int(10 + (y / background.get_height()) * 20)
             pygame.draw.line(background, (darkness, darkness, darkness), (0, y), (background.get_width(), y))
+        background = background.convert()
 
 # Game variables
 score = 0
@@ -442,6 +1177,7 @@ hit_effects = []
 fast_mode = False
 fullscreen = False
 current_song = None
+current_difficulty = "normal"
 particles = []
 accuracy = 0
 total_arrows = 0
@@ -450,9 +1186,46 @@ waiting_for_end_screen = False
 game_paused = False
 pause_time = 0
 pause_offset = 0
+song_length = 0
+playlist = []
+playlist_index = 0
+playlist_queued = False
+song_result = None
+previous_best = None
+timing_counts = None
+timing_mean = 0
+timing_std = 0
+timing_telemetry = TimingTelemetry(TIMING_BUFFER_SIZE)
+calibration_telemetry = TimingTelemetry(CALIBRATION_TAPS)
+click_sound = None
+cue_times = []
+calibration_phase = "audio"
+calibration_start = 0
+calibration_taps = 0
+low_alloc_mode = False
+gc_monitor = GCMonitor()
 
 # Initialize song selector
 song_selector = SongSelector()
+prefetcher = PlaylistPrefetcher()
+results_store = ResultsStore(RESULTS_DB)
+
+# Latency is measured per machine and audio/display setup
+device_key = f"{platform.node()}|{pygame.display.get_driver()}|{pygame.mixer.get_init()}"
+# Audio latency is how late the player hears the song, visual latency how late they see
+# a frame. Presses are judged against the audio, and arrows are drawn shifted by the
+# difference so that they cross the hit zone as the note is heard.
+stored_latency = results_store.load_calibration(device_key)
+if stored_latency is not None:
+    audio_latency, visual_latency = stored_latency[0] / 1000, stored_latency[1] / 1000
+else:
+    audio_latency = visual_latency = 0.0
+
+def save_song_result(result):
+    """Queue a song whose notes have all been judged for the results store"""
+    results_store.record_play(PLAYER_NAME, os.path.basename(result.song), result.difficulty,
+                              result.score, result.hits, result.total,
+                              result.max_combo, result.judgments)
 
 try:
     title_font = pygame.font.Font("arcade.ttf", 72)
@@ -467,11 +1240,19 @@ except:
     combo_font = pygame.font.SysFont('Arial', 48)
     effect_font = pygame.font.SysFont('Arial', 24)
 
+# HUD text is re-rendered only when it changes
+score_text_cache = CachedText(score_font, WHITE)
+combo_text_cache = CachedText(get_font(32), NEON_PINK)
+song_name_cache = CachedText(effect_font, WHITE)
+percent_text_cache = CachedText(effect_font, WHITE)
+gc_text_cache = CachedText(effect_font, NEON_YELLOW)
+
 STATE_OPENING = 0
 STATE_MENU = 1
 STATE_SONG_SELECT = 2
 STATE_PLAYING = 3
 STATE_GAME_OVER = 4
+STATE_CALIBRATION = 5
 
 current_state = STATE_OPENING
 opening_start = time.time()
@@ -479,9 +1260,9 @@ game_over_time = 0
 
 running = True
 while running:
-    dt = clock.tick(FPS) / 1000.0
+    dt, events = input_clock.tick()
     
-    for event in pygame.event.get():
+    for event_time, event in events:
         if event.type == pygame.QUIT:
             running = False
         
@@ -494,6 +1275,20 @@ while running:
                     current_state = STATE_SONG_SELECT
                 elif event.key == pygame.K_f:
                     fast_mode = not fast_mode
+                elif event.key == pygame.K_g:
+                    low_alloc_mode = not low_alloc_mode
+                elif event.key == pygame.K_c:
+                    try:
+                        if click_sound is None:
+                            click_sound = make_click_sound()
+                        cue_times = []
+                        calibration_phase = "audio"
+                        calibration_taps = 0
+                        calibration_telemetry.reset()
+                        calibration_start = time.time()
+                        current_state = STATE_CALIBRATION
+                    except Exception as e:
+                        print(f"Error starting calibration: {e}")
                 elif event.key == pygame.K_1:
                     fullscreen = not fullscreen
                     if fullscreen:
@@ -506,8 +1301,25 @@ while running:
             if result == "song_selected" and not song_selector.empty_folder:
                 current_song = os.path.join(song_selector.soundtrack_folder, song_selector.selected_song)
                 current_state = STATE_PLAYING
-                beat_times = get_beat_times(current_song)
-                arrows = [Arrow(random.choice(list(COLORS.keys())), float(t)) for t in beat_times]
+                if song_selector.playlist_mode:
+                    playlist = song_selector.build_playlist()
+                else:
+                    playlist = [current_song]
+                playlist_index = 0
+                playlist_queued = False
+                current_difficulty = song_selector.difficulty
+                if current_song not in prefetcher.chart_cache:
+                    prefetcher.chart_cache[current_song] = analyze_song(current_song)
+                charts, song_length = prefetcher.chart_cache[current_song]
+                song_result = SongResult(current_song, current_difficulty, len(charts[current_difficulty]))
+                arrows = build_arrows(charts[current_difficulty], song_result)
+                pause_offset = 0
+                timing_telemetry.reset()
+                if low_alloc_mode:
+                    begin_low_alloc_play()
+                    gc_monitor.sample()  # Drop the counts from loading so the HUD starts clean
+                if len(playlist) > 1:
+                    prefetcher.start(playlist[1])
                 try:
                     pygame.mixer.music.load(current_song)
                     start_time = time.time()
@@ -518,20 +1330,46 @@ while running:
                         pygame.mixer.music.play()
                 except Exception as e:
                     print(f"Error loading music: {e}")
+                    if low_alloc_mode:
+                        end_low_alloc_play()
                     current_state = STATE_SONG_SELECT
-                    hit_effects.append({
-                        'text': "ERROR LOADING SONG!",
-                        'color': NEON_RED,
-                        'x': SCREEN_WIDTH//2 - 100,
-                        'y': SCREEN_HEIGHT//2,
-                        'timer': 60,
-                        'size': 1.0
-                    })
+                    spawn_hit_effect(hit_effects, "ERROR LOADING SONG!", NEON_RED,
+                                     SCREEN_WIDTH//2 - 100, SCREEN_HEIGHT//2, 60, 1.0)
             elif result == "back":
                 current_state = STATE_MENU
         
         elif current_state == STATE_PLAYING:
-            if event.type == pygame.KEYDOWN:
+            if event.type == SONG_END_EVENT and playlist_queued:
+                # The mixer has already moved on to the queued song. Arrows still falling
+                # belong to the old one, so move them onto the new song's clock and let
+                # them drain alongside the new chart
+                song_clock = time.time() - start_time - pause_offset
+                shifted = {song_result}
+                for arrow in arrows:
+                    arrow.spawn_time -= song_clock
+                    shifted.add(arrow.result)
+                for result in shifted:
+                    result.time_shift += song_clock
+                if song_result.total == song_result.notes:
+                    save_song_result(song_result)
+                playlist_index += 1
+                playlist_queued = False
+                current_song = playlist[playlist_index]
+                chart = prefetcher.charts[current_difficulty]
+                song_result = SongResult(current_song, current_difficulty, len(chart))
+                arrows.extend(build_arrows(chart, song_result))
+                if low_alloc_mode:
+                    # No time to collect mid-playlist, just move the new chart out of the GC's reach
+                    gc.freeze()
+                song_length = prefetcher.song_length
+                start_time = time.time()
+                pause_offset = 0
+                if playlist_index + 1 < len(playlist):
+                    prefetcher.start(playlist[playlist_index + 1])
+                else:
+                    prefetcher.reset()
+            
+            elif event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_f:
                     fast_mode = not fast_mode
                     if pygame.mixer.music.get_busy() and not game_paused:
@@ -546,16 +1384,27 @@ while running:
                                 pygame.mixer.music.play(0, current_pos)
                         except:
                             pass
+                        # stop() posts an end event for the track we just restarted, and
+                        # reloading drops the queued playlist song
+                        pygame.event.clear(SONG_END_EVENT)
+                        playlist_queued = False
                 elif event.key == pygame.K_ESCAPE:
                     pygame.mixer.music.stop()
                     current_state = STATE_MENU
                     score = 0
                     combo = 0
+                    effect_pool.extend(hit_effects)
                     hit_effects = []
+                    arrow_pool.extend(arrows)
+                    arrows = []
                     total_arrows = 0
                     hit_arrows = 0
                     waiting_for_end_screen = False
                     game_paused = False
+                    end_low_alloc_play()
+                    playlist = []
+                    playlist_queued = False
+                    prefetcher.reset()
                 elif event.key == pygame.K_BACKSPACE and waiting_for_end_screen:
                     if total_arrows > 0:
                         accuracy = (hit_arrows / total_arrows) * 100
@@ -563,6 +1412,15 @@ while running:
                         accuracy = 0
                     
                     pygame.mixer.music.stop()
+                    if len(playlist) <= 1:
+                        previous_best = results_store.personal_best(PLAYER_NAME, os.path.basename(current_song),
+                                                                   current_difficulty)
+                    else:
+                        previous_best = None
+                    save_song_result(song_result)
+                    end_low_alloc_play()
+                    timing_mean, timing_std = timing_telemetry.stats()
+                    timing_counts = timing_telemetry.histogram(TIMING_HISTOGRAM_BINS, HIT_WINDOW * 1000)
                     game_over_time = time.time()
                     particles = [Particle(random.randint(0, SCREEN_WIDTH), 
                                         random.randint(0, SCREEN_HEIGHT)) 
@@ -577,6 +1435,45 @@ while running:
                         game_paused = True
                         pygame.mixer.music.pause()
                         pause_time = time.time()
+                        if low_alloc_mode:
+                            # Pausing is a safe moment to catch up on collection
+                            gc.collect()
+                elif event.key in LANE_DIRECTIONS and not game_paused:
+                    # Judge the press from when it arrived, moved back by this machine's
+                    # audio latency, against the closest note in its lane
+                    direction = LANE_DIRECTIONS[event.key]
+                    press_time = event_time - start_time - pause_offset - audio_latency
+                    hit_arrow = None
+                    hit_offset = 0
+                    for arrow in arrows:
+                        offset = press_time - (arrow.spawn_time + ARROW_TRAVEL_TIME)
+                        if (arrow.direction == direction and 
+                            not arrow.hit and 
+                            abs(offset) <= HIT_WINDOW and
+                            (hit_arrow is None or abs(offset) < abs(hit_offset))):
+                            hit_arrow = arrow
+                            hit_offset = offset
+                    
+                    if hit_arrow:
+                        hit_arrow.hit = True
+                        hit_arrow.glow = False
+                        hit_arrow.original_y = hit_arrow.y
+                        hit_arrow.bounce_time = BOUNCE_DURATION * FPS
+                        
+                        points = 100 + (combo // 5) * 10
+                        score += points
+                        combo += 1
+                        hit_arrows += 1
+                        result = hit_arrow.result
+                        result.score += points
+                        result.hits += 1
+                        result.max_combo = max(result.max_combo, combo)
+                        result.judgments.append((hit_arrow.spawn_time + result.time_shift, hit_arrow.direction,
+                                                 "PERFECT", hit_offset * 1000))
+                        timing_telemetry.record(hit_offset * 1000)
+                        
+                        spawn_hit_effect(hit_effects, f"PERFECT! +{points}", NEON_GREEN,
+                                         hit_arrow.x - 50, HIT_ZONE_Y - 80, 45, 0.5)
                 
                 # Update Miku image based on key press
                 if miku_images:
@@ -589,16 +1486,47 @@ while running:
                     elif event.key == pygame.K_DOWN:
                         current_miku_image = miku_images["down"]
         
+        elif current_state == STATE_CALIBRATION:
+            if event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_ESCAPE:
+                    current_state = STATE_MENU
+                elif event.key == pygame.K_SPACE and cue_times and calibration_telemetry.count < CALIBRATION_TAPS:
+                    tap_time = event_time
+                    nearest_cue = min(cue_times, key=lambda t: abs(tap_time - t))
+                    calibration_taps += 1
+                    if calibration_taps > CALIBRATION_WARMUP:
+                        calibration_telemetry.record((tap_time - nearest_cue) * 1000)
+                    if calibration_telemetry.count >= CALIBRATION_TAPS:
+                        # Median so a stray early or late tap doesn't skew the result
+                        offset_ms = float(np.median(calibration_telemetry.samples()))
+                        if calibration_phase == "audio":
+                            # Then the same again with flashes at the hit zone instead of clicks
+                            audio_latency = offset_ms / 1000
+                            calibration_phase = "visual"
+                            cue_times = []
+                            calibration_taps = 0
+                            calibration_telemetry.reset()
+                            calibration_start = tap_time
+                        else:
+                            visual_latency = offset_ms / 1000
+                            results_store.save_calibration(device_key, audio_latency * 1000, offset_ms)
+        
         elif current_state == STATE_GAME_OVER:
             if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
                 current_state = STATE_MENU
                 score = 0
                 combo = 0
+                effect_pool.extend(hit_effects)
                 hit_effects = []
                 total_arrows = 0
                 hit_arrows = 0
                 particles = []
                 waiting_for_end_screen = False
+                playlist = []
+    
+    if renderer and current_state != STATE_PLAYING:
+        # Every other screen draws directly, so let the render thread finish first
+        renderer.wait_idle()
     
     if current_state == STATE_OPENING:
         screen.fill(DARK_GRAY)
@@ -631,6 +1559,11 @@ while running:
         screen.blit(keys_img, (SCREEN_WIDTH//2 - keys_img.get_width()//2, SCREEN_HEIGHT//2 - 50))
         screen.blit(subtitle, (SCREEN_WIDTH//2 - subtitle.get_width()//2, SCREEN_HEIGHT//2 + 100))
         screen.blit(controls, (SCREEN_WIDTH//2 - controls.get_width()//2, SCREEN_HEIGHT//2 + 150))
+        calibrate = subtitle_font.render(f"C: CALIBRATE LATENCY  (AUDIO {audio_latency * 1000:+.0f} ms, "
+                                         f"VIDEO {visual_latency * 1000:+.0f} ms)", True, WHITE)
+        screen.blit(calibrate, (SCREEN_WIDTH//2 - calibrate.get_width()//2, SCREEN_HEIGHT//2 + 200))
+        low_alloc = subtitle_font.render(f"G: LOW-ALLOCATION MODE  ({'ON' if low_alloc_mode else 'OFF'})", True, WHITE)
+        screen.blit(low_alloc, (SCREEN_WIDTH//2 - low_alloc.get_width()//2, SCREEN_HEIGHT//2 + 250))
     
     elif current_state == STATE_SONG_SELECT:
         back_rect = song_selector.draw(screen)
@@ -641,154 +1574,156 @@ while running:
         else:
             elapsed_time = pause_time - start_time - pause_offset
         
-        screen.fill(DARK_GRAY)
-        screen.blit(background, (MARGIN_SIZE, MARGIN_SIZE))
-        draw_frame(screen)
+        # In pipelined mode this frame is recorded and handed to the render thread
+        canvas = DrawList() if renderer else screen
+        canvas.fill(DARK_GRAY)
+        canvas.blit(background, (MARGIN_SIZE, MARGIN_SIZE))
+        draw_frame(canvas)
         
         # Update Teto animation based on Miku's position
         teto_animation.update(dt * 1000, [IMAGE_X, IMAGE_Y])  # dt in milliseconds
         
         # Draw Teto images (behind Miku)
-        teto_animation.draw(screen)
+        teto_animation.draw(canvas)
         
         # Draw Miku character in the center if images are loaded
         if current_miku_image:
             image_rect = current_miku_image.get_rect()
-            screen.blit(current_miku_image, (IMAGE_X - image_rect.width // 2, 
+            canvas.blit(current_miku_image, (IMAGE_X - image_rect.width // 2, 
                                            IMAGE_Y - image_rect.height // 2))
         
         # Draw song progress bar and name at top
         try:
-            song_length = pygame.mixer.Sound(current_song).get_length()
             progress = min(elapsed_time / song_length, 1.0)
             
             # Draw song name above progress bar
             if current_song:
                 song_name = os.path.splitext(os.path.basename(current_song))[0]
-                name_text = effect_font.render(song_name, True, WHITE)
-                screen.blit(name_text, (SCREEN_WIDTH//2 - name_text.get_width()//2, PROGRESS_BAR_Y - 25))
+                if len(playlist) > 1:
+                    song_name += f"  ({playlist_index + 1}/{len(playlist)})"
+                name_text = song_name_cache.render(song_name)
+                canvas.blit(name_text, (SCREEN_WIDTH//2 - name_text.get_width()//2, PROGRESS_BAR_Y - 25))
             
             # Draw progress bar
-            pygame.draw.rect(screen, GRAY, (SCREEN_WIDTH//2 - PROGRESS_BAR_WIDTH//2, PROGRESS_BAR_Y, 
+            draw_rect(canvas, GRAY, (SCREEN_WIDTH//2 - PROGRESS_BAR_WIDTH//2, PROGRESS_BAR_Y, 
                                           PROGRESS_BAR_WIDTH, PROGRESS_BAR_HEIGHT))
-            pygame.draw.rect(screen, NEON_GREEN, (SCREEN_WIDTH//2 - PROGRESS_BAR_WIDTH//2, PROGRESS_BAR_Y, 
+            draw_rect(canvas, NEON_GREEN, (SCREEN_WIDTH//2 - PROGRESS_BAR_WIDTH//2, PROGRESS_BAR_Y, 
                                                 int(PROGRESS_BAR_WIDTH * progress), PROGRESS_BAR_HEIGHT))
             # Draw progress percentage
-            percent_text = effect_font.render(f"{int(progress * 100)}%", True, WHITE)
-            screen.blit(percent_text, (SCREEN_WIDTH//2 - percent_text.get_width()//2, PROGRESS_BAR_Y + PROGRESS_BAR_HEIGHT + 5))
+            percent_text = percent_text_cache.render(f"{int(progress * 100)}%")
+            canvas.blit(percent_text, (SCREEN_WIDTH//2 - percent_text.get_width()//2, PROGRESS_BAR_Y + PROGRESS_BAR_HEIGHT + 5))
         except:
             pass
         
-        # Update and draw arrows
-        for arrow in arrows[:]:
-            if not game_paused and elapsed_time >= arrow.spawn_time:
-                arrow.update(elapsed_time, combo)
-                if arrow.y < SCREEN_HEIGHT:
-                    arrow.draw(screen)
-                elif not arrow.hit:
-                    arrows.remove(arrow)
-                    combo = 0
-                    hit_effects.append({
-                        'text': "MISS!",
-                        'color': NEON_RED,
-                        'x': arrow.x,
-                        'y': HIT_ZONE_Y - 50,
-                        'timer': 30,
-                        'size': 1.0
-                    })
-                    total_arrows += 1
-                elif arrow.hit:
-                    arrows.remove(arrow)
-                    total_arrows += 1
-                    hit_arrows += 1
-            elif game_paused and elapsed_time >= arrow.spawn_time and arrow.y < SCREEN_HEIGHT:
-                arrow.draw(screen)
-        
-        draw_hit_zone(screen)
+        # Queue the next playlist song as soon as it has been prepared
+        if (not playlist_queued and not game_paused and playlist_index + 1 < len(playlist)
+                and prefetcher.ready and pygame.mixer.music.get_busy()):
+            try:
+                pygame.mixer.music.queue(playlist[playlist_index + 1])
+                playlist_queued = True
+            except Exception as e:
+                print(f"Error loading music: {e}")
+                playlist = playlist[:playlist_index + 1]
         
-        if not game_paused:
-            keys = pygame.key.get_pressed()
-            for key, direction in zip([pygame.K_LEFT, pygame.K_DOWN, pygame.K_UP, pygame.K_RIGHT],
-                                    ["left", "down", "up", "right"]):
-                if keys[key]:
-                    for arrow in arrows:
-                        if (arrow.direction == direction and 
-                            not arrow.hit and 
-                            abs(arrow.y + ARROW_SIZE - HIT_ZONE_Y) <= HIT_MARGIN):
-                            arrow.hit = True
-                            arrow.glow = False
-                            arrow.original_y = arrow.y
-                            arrow.bounce_time = BOUNCE_DURATION * FPS
-                            
-                            points = 100 + (combo // 5) * 10
-                            score += points
-                            combo += 1
-                            hit_arrows += 1
-                            
-                            hit_effects.append({
-                                'text': f"PERFECT! +{points}",
-                                'color': NEON_GREEN,
-                                'x': arrow.x - 50,
-                                'y': HIT_ZONE_Y - 80,
-                                'timer': 45,
-                                'size': 0.5
-                            })
-                            break
-        
-        for effect in hit_effects[:]:
-            effect['size'] = min(effect['size'] + 0.05, 1.2)
-            size = int(24 * effect['size'])
-            
-            text_surface = pygame.Surface((200, 50), pygame.SRCALPHA)
-            font = pygame.font.SysFont('Arial', size)
-            
-            for dx, dy in [(-1,-1), (-1,1), (1,-1), (1,1)]:
-                outline = font.render(effect["text"], True, BLACK)
-                text_surface.blit(outline, (25 + dx, 10 + dy))
-            
-            main_text = font.render(effect["text"], True, effect["color"])
-            text_surface.blit(main_text, (25, 10))
+        # Update and draw arrows, compacting the list in place rather than copying it.
+        # They run on a clock shifted by the calibrated latencies so each one is seen
+        # crossing the hit zone as its note is heard.
+        arrow_time = elapsed_time - audio_latency + visual_latency
+        kept = 0
+        for arrow in arrows:
+            keep = True
+            if not game_paused and arrow_time >= arrow.spawn_time:
+                arrow.update(arrow_time, combo)
+                if arrow.hit and arrow.bounce_time <= 0:
+                    # Hit arrows leave once their bounce is done (already counted in hit_arrows)
+                    keep = False
+                elif arrow.y < SCREEN_HEIGHT:
+                    arrow.draw(canvas)
+                else:
+                    keep = False
+                    combo = 0
+                    arrow.result.judgments.append((arrow.spawn_time + arrow.result.time_shift,
+                                                   arrow.direction, "MISS", None))
+                    spawn_hit_effect(hit_effects, "MISS!", NEON_RED, arrow.x, HIT_ZONE_Y - 50, 30, 1.0)
+            elif game_paused and arrow_time >= arrow.spawn_time and arrow.y < SCREEN_HEIGHT:
+                arrow.draw(canvas)
             
-            screen.blit(text_surface, (effect["x"], effect["y"]))
-            effect["timer"] -= 1
-            effect["y"] -= 1
-            if effect["timer"] <= 0:
-                hit_effects.remove(effect)
+            if keep:
+                arrows[kept] = arrow
+                kept += 1
+            else:
+                total_arrows += 1
+                arrow.result.total += 1
+                if arrow.result is not song_result and arrow.result.total == arrow.result.notes:
+                    # The last note of a playlist song that has already ended
+                    save_song_result(arrow.result)
+                arrow_pool.append(arrow)
+        del arrows[kept:]
+        
+        draw_hit_zone(canvas)
         
-        score_text = score_font.render(f"SCORE: {score}", True, WHITE)
-        pygame.draw.rect(screen, (0, 0, 0, 150), (15, 15, score_text.get_width() + 20, score_text.get_height() + 10))
-        screen.blit(score_text, (25, 20))
+        kept = 0
+        for effect in hit_effects:
+            effect.update_and_draw(canvas)
+            if effect.timer > 0:
+                hit_effects[kept] = effect
+                kept += 1
+            else:
+                effect_pool.append(effect)
+        del hit_effects[kept:]
+        
+        score_text = score_text_cache.render(f"SCORE: {score}")
+        draw_rect(canvas, (0, 0, 0, 150), (15, 15, score_text.get_width() + 20, score_text.get_height() + 10))
+        canvas.blit(score_text, (25, 20))
         
         if combo > 0:
             combo_size = min(32 + combo // 2, 72)
-            current_combo_font = pygame.font.SysFont('Arial', combo_size)
-            combo_text = current_combo_font.render(f"{combo}x", True, NEON_PINK)
-            screen.blit(combo_text, (SCREEN_WIDTH - 150 - combo_size//2, 20))
+            combo_text_cache.font = get_font(combo_size)
+            combo_text = combo_text_cache.render(f"{combo}x")
+            canvas.blit(combo_text, (SCREEN_WIDTH - 150 - combo_size//2, 20))
         
         if fast_mode:
             fast_text = score_font.render("FAST MODE", True, NEON_RED)
-            pygame.draw.rect(screen, (0, 0, 0, 150), 
+            draw_rect(canvas, (0, 0, 0, 150), 
                            (SCREEN_WIDTH - fast_text.get_width() - 30, SCREEN_HEIGHT - 45, 
                             fast_text.get_width() + 20, fast_text.get_height() + 10))
-            screen.blit(fast_text, (SCREEN_WIDTH - fast_text.get_width() - 20, SCREEN_HEIGHT - 40))
+            canvas.blit(fast_text, (SCREEN_WIDTH - fast_text.get_width() - 20, SCREEN_HEIGHT - 40))
+        
+        if low_alloc_mode:
+            net_objects, collections, pause_ms = gc_monitor.sample()
+            gc_text = gc_text_cache.render(f"NET GC OBJECTS/FRAME: {net_objects:+d}  GC: {collections} ({pause_ms:.1f} ms)")
+            canvas.blit(gc_text, (25, 65))
         
         if game_paused:
             pause_text = title_font.render("PAUSED", True, NEON_RED)
-            screen.blit(pause_text, (SCREEN_WIDTH//2 - pause_text.get_width()//2, SCREEN_HEIGHT//2 - 100))
+            canvas.blit(pause_text, (SCREEN_WIDTH//2 - pause_text.get_width()//2, SCREEN_HEIGHT//2 - 100))
         
         if len(arrows) == 0 and not pygame.mixer.music.get_busy() and not game_paused:
-            waiting_for_end_screen = True
-            # Calculate accuracy here before showing results
-            if total_arrows > 0:
-                accuracy = (hit_arrows / total_arrows) * 100
+            if playlist_index + 1 < len(playlist):
+                # The next song wasn't ready in time to be queued, start it once it is
+                waiting_for_end_screen = False
+                if prefetcher.ready and not playlist_queued:
+                    try:
+                        pygame.mixer.music.load(playlist[playlist_index + 1])
+                        pygame.mixer.music.play()
+                        playlist_queued = True
+                        pygame.event.post(pygame.event.Event(SONG_END_EVENT))
+                    except Exception as e:
+                        print(f"Error loading music: {e}")
+                        playlist = playlist[:playlist_index + 1]
             else:
-                accuracy = 0
+                waiting_for_end_screen = True
+                # Calculate accuracy here before showing results
+                if total_arrows > 0:
+                    accuracy = (hit_arrows / total_arrows) * 100
+                else:
+                    accuracy = 0
         else:
             waiting_for_end_screen = False
 
         if waiting_for_end_screen:
             prompt_text = subtitle_font.render("Press BACKSPACE to view results", True, NEON_GREEN)
-            screen.blit(prompt_text, (SCREEN_WIDTH//2 - prompt_text.get_width()//2, SCREEN_HEIGHT//2 + 50))
+            canvas.blit(prompt_text, (SCREEN_WIDTH//2 - prompt_text.get_width()//2, SCREEN_HEIGHT//2 + 50))
     
     elif current_state == STATE_GAME_OVER:
         screen.fill(DARK_GRAY)
@@ -812,10 +1747,58 @@ while running:
         accuracy_text = title_font.render(f"ACCURACY: {accuracy:.1f}%", True, NEON_GREEN)
         screen.blit(accuracy_text, (SCREEN_WIDTH//2 - accuracy_text.get_width()//2, 350))
         
+        if previous_best is not None:
+            if score > previous_best:
+                best_text = subtitle_font.render(f"NEW BEST! (was {previous_best})", True, NEON_YELLOW)
+            else:
+                best_text = subtitle_font.render(f"PERSONAL BEST: {previous_best}", True, WHITE)
+            screen.blit(best_text, (SCREEN_WIDTH//2 - best_text.get_width()//2, 440))
+        
         restart_text = subtitle_font.render("Press ESC to return to menu", True, WHITE)
         screen.blit(restart_text, (SCREEN_WIDTH//2 - restart_text.get_width()//2, 500))
+        
+        if timing_counts is not None and timing_telemetry.count > 0:
+            draw_timing_histogram(screen, timing_counts, timing_mean, timing_std, SCREEN_WIDTH//2, 550)
+    
+    elif current_state == STATE_CALIBRATION:
+        screen.fill(DARK_GRAY)
+        draw_frame(screen)
+        
+        calibrating = calibration_telemetry.count < CALIBRATION_TAPS
+        now = time.time()
+        if calibrating and now >= calibration_start + (len(cue_times) + 1) * CALIBRATION_INTERVAL:
+            if calibration_phase == "audio":
+                click_sound.play()
+            cue_times.append(now)
+        
+        if calibration_phase == "visual":
+            draw_hit_zone(screen)
+            if calibrating and cue_times and now - cue_times[-1] < CALIBRATION_FLASH:
+                draw_rect(screen, NEON_YELLOW, (SCREEN_WIDTH - (SCREEN_WIDTH - 850) - 50, HIT_ZONE_Y - HIT_MARGIN,
+                                                SCREEN_WIDTH - 850, HIT_MARGIN * 2))
+        
+        title = title_font.render("CALIBRATION", True, NEON_GREEN)
+        screen.blit(title, (SCREEN_WIDTH//2 - title.get_width()//2, SCREEN_HEIGHT//4))
+        if calibrating:
+            if calibration_phase == "audio":
+                instr = subtitle_font.render("Press SPACE on every click", True, WHITE)
+            else:
+                instr = subtitle_font.render("Press SPACE on every flash", True, WHITE)
+            progress_text = subtitle_font.render(f"TAPS: {calibration_telemetry.count}/{CALIBRATION_TAPS}", True, NEON_YELLOW)
+        else:
+            instr = subtitle_font.render(f"AUDIO: {audio_latency * 1000:+.1f} ms  VIDEO: {visual_latency * 1000:+.1f} ms"
+                                         " - saved for this machine", True, WHITE)
+            progress_text = subtitle_font.render("Press ESC to return to menu", True, NEON_YELLOW)
+        screen.blit(instr, (SCREEN_WIDTH//2 - instr.get_width()//2, SCREEN_HEIGHT//2))
+        screen.blit(progress_text, (SCREEN_WIDTH//2 - progress_text.get_width()//2, SCREEN_HEIGHT//2 + 60))
     
-    pygame.display.flip()
+    if renderer and current_state == STATE_PLAYING:
+        renderer.publish(canvas)
+    else:
+        pygame.display.flip()
 
+if renderer:
+    renderer.stop()
+results_store.close()
 pygame.quit()
 sys.exit()
\ No newline at end of file